@@ -2,12 +2,21 @@ import logging
 import os
 import asyncio
 import aiohttp
+from aiolimiter import AsyncLimiter
+
+# Pyrogram grabs the current event loop at import time, so a uvloop loop must be set first.
+try:
+    import uvloop
+    asyncio.set_event_loop(uvloop.new_event_loop())
+except ImportError:
+    pass
+
 from pyromod import Client
 from aiohttp import web
 from config import Config
 from database.db import get_user, save_file_data, get_owner_db_channel, remove_from_list
 from utils.helpers import create_post, get_main_menu
-from handlers.new_post import get_batch_key
+from features.poster import close_session, load_poster_cache, save_poster_cache, as_input_photo, FONT_PATH
 from pyrogram.errors import (
     ChatAdminRequired, UserNotParticipant, FloodWait,
     WebpageCurlFailed, ChannelPrivate, WebpageMediaEmpty
@@ -19,17 +28,16 @@ logging.getLogger("pyromod").setLevel(logging.WARNING)
 logging.getLogger("imdbpy").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
+# Typed app key for the redirect URL template; plain string keys make aiohttp warn at startup.
+REDIRECT_TEMPLATE = web.AppKey("redirect_template", str)
+
 async def handle_redirect(request):
     file_unique_id = request.match_info.get('file_unique_id', None)
     if not file_unique_id: return web.Response(text="File ID missing.", status=400)
-    try:
-        with open(Config.BOT_USERNAME_FILE, 'r') as f: bot_username = f.read().strip().replace("@", "")
-    except FileNotFoundError:
-        logger.error(f"FATAL: Bot username file not found at {Config.BOT_USERNAME_FILE}")
-        return web.Response(text="Bot configuration error.", status=500)
-    payload = f"get_{file_unique_id}"
-    telegram_url = f"https://t.me/{bot_username}?start={payload}"
-    return web.HTTPFound(telegram_url)
+    return web.Response(status=302, headers={'Location': request.app[REDIRECT_TEMPLATE] % file_unique_id})
+
+def _write_file(path, data, mode='w'):
+    with open(path, mode) as f: f.write(data)
 
 class Bot(Client):
     def __init__(self):
@@ -38,16 +46,19 @@ class Bot(Client):
         self.owner_db_channel_id = None
         self.web_app = None
         self.web_runner = None
+        # Each item is one batch of same-title files, grouped by handlers/new_post.py.
         self.file_queue = asyncio.Queue()
-        self.file_batch = {}
-        self.batch_timers = {}
-        self.batch_locks = asyncio.Lock()
+        # Shared cap on outgoing copies/posts, kept under Telegram's ~30 msg/s bot limit.
+        self.send_limiter = AsyncLimiter(20, 1)
+        self.post_semaphore = asyncio.Semaphore(5)
+        # Running post_batch tasks, referenced until they finish so none is garbage-collected mid-flight.
+        self.post_tasks = set()
 
     async def file_processor_worker(self):
         logger.info("File processor worker started.")
         while True:
             try:
-                message_to_process, user_id = await self.file_queue.get()
+                messages, user_id = await self.file_queue.get()
                 user = await get_user(user_id)
                 if not user or not user.get('db_channels') or not user.get('post_channels'):
                     logger.warning(f"User {user_id} has not completed setup. Sending guidance.")
@@ -62,78 +73,93 @@ class Bot(Client):
                 if not self.owner_db_channel_id:
                     logger.error("Owner DB not set. Worker sleeping.")
                     await asyncio.sleep(60)
-                    await self.file_queue.put((message_to_process, user_id))
+                    await self.file_queue.put((messages, user_id))
                     continue
 
-                copied_message = await message_to_process.copy(chat_id=self.owner_db_channel_id)
-                await save_file_data(owner_id=user_id, original_message=message_to_process, copied_message=copied_message)
-                
-                filename = getattr(copied_message, copied_message.media.value).file_name
-                batch_key = get_batch_key(filename)
-
-                async with self.batch_locks:
-                    if user_id not in self.file_batch:
-                        self.file_batch[user_id] = {}
-                        self.batch_timers[user_id] = {}
-                    
-                    if batch_key not in self.file_batch[user_id]:
-                        self.file_batch[user_id][batch_key] = []
-                    self.file_batch[user_id][batch_key].append(copied_message)
-
-                    if batch_key in self.batch_timers[user_id]:
-                        self.batch_timers[user_id][batch_key].cancel()
-                    
-                    self.batch_timers[user_id][batch_key] = asyncio.get_event_loop().call_later(
-                        15,
-                        lambda uid=user_id, bk=batch_key: asyncio.create_task(self.process_batch_task(uid, bk))
-                    )
+                originals, copies = [], []
+                for message in messages:
+                    try:
+                        async with self.send_limiter:
+                            copies.append(await message.copy(chat_id=self.owner_db_channel_id))
+                        originals.append(message)
+                    except Exception:
+                        logger.exception(f"Failed to copy message {message.id} for user {user_id}")
+                if not copies: continue
+                results = await asyncio.gather(*(
+                    save_file_data(owner_id=user_id, original_message=original, copied_message=copied)
+                    for original, copied in zip(originals, copies)
+                ), return_exceptions=True)
+                # A copy without a DB record would give a dead link, so only saved files are posted.
+                saved = []
+                for original, copied, error in zip(originals, copies, results):
+                    if isinstance(error, Exception):
+                        logger.error(f"Failed to save file data for message {original.id} of user {user_id}", exc_info=error)
+                    else:
+                        saved.append(copied)
+                if not saved: continue
+                task = asyncio.create_task(self.post_batch(user_id, saved))
+                self.post_tasks.add(task)
+                task.add_done_callback(self.post_tasks.discard)
             except Exception:
                 logger.exception("Error in file processor worker")
             finally:
                 if 'self.file_queue' in locals() and self.file_queue: self.file_queue.task_done()
 
-    async def process_batch_task(self, user_id, batch_key):
-        async with self.batch_locks:
-            if user_id not in self.file_batch or batch_key not in self.file_batch[user_id]:
-                return
-            messages = self.file_batch[user_id].pop(batch_key, [])
-            if user_id in self.batch_timers and batch_key in self.batch_timers[user_id]:
-                self.batch_timers[user_id].pop(batch_key)
-        
-        if not messages: return
-        
+    async def post_batch(self, user_id, messages):
+        """Builds one post for a batch of copied files and sends it to every post channel."""
         try:
             user = await get_user(user_id)
             if not user or not user.get('post_channels'): return
 
-            poster, caption, footer_keyboard = await create_post(self, user_id, messages)
+            poster, caption, footer_keyboard = await create_post(self, user_id, messages, user)
             if not caption: return
             
-            for channel_id in user.get('post_channels', []).copy():
-                try:
-                    await self.send_photo(channel_id, photo=poster, caption=caption, reply_markup=footer_keyboard)
-                    await asyncio.sleep(3)
-                except FloodWait as e:
-                    logger.warning(f"FloodWait in {channel_id}. Sleeping for {e.value + 5} seconds.")
-                    await asyncio.sleep(e.value + 5)
-                    await self.send_photo(channel_id, photo=poster, caption=caption, reply_markup=footer_keyboard)
-                except (ChannelPrivate, ChatAdminRequired, UserNotParticipant):
+            channels = list(user.get('post_channels', []))
+            results = await asyncio.gather(
+                *(self._post_to_channel(channel_id, poster, caption, footer_keyboard) for channel_id in channels),
+                return_exceptions=True
+            )
+            for channel_id, error in zip(channels, results):
+                if isinstance(error, (ChannelPrivate, ChatAdminRequired, UserNotParticipant)):
                     logger.error(f"PERMISSION ERROR in {channel_id} for user {user_id}. Removing channel.")
                     await remove_from_list(user_id, 'post_channels', channel_id)
                     await self.send_message(user_id, f"⚠️ **Auto-Posting Disabled**\nI failed to post to channel ID `{channel_id}`. I have removed it from your settings.")
-                except Exception as e:
-                    logger.error(f"Unexpected error posting to {channel_id} for user {user_id}: {e}")
+                elif isinstance(error, Exception):
+                    logger.error(f"Unexpected error posting to {channel_id} for user {user_id}: {error}")
                     try:
-                        await self.send_message(user_id, f"An error occurred posting to channel `{channel_id}`: {e}")
+                        await self.send_message(user_id, f"An error occurred posting to channel `{channel_id}`: {error}")
                     except Exception:
                          logger.error(f"Failed to send error notification to user {user_id}")
         except Exception:
-            logger.exception(f"Major error in process_batch_task for user {user_id}")
+            logger.exception(f"Major error in post_batch for user {user_id}")
+
+    async def _post_to_channel(self, channel_id, poster, caption, footer_keyboard):
+        """Posts one batch to one channel, retrying once after a FloodWait. Other errors propagate to the caller."""
+        try:
+            await self._send_post_limited(channel_id, poster, caption, footer_keyboard)
+        except FloodWait as e:
+            # The slot is released while sleeping so one user's flood-wait does not hold up other users' posts.
+            logger.warning(f"FloodWait in {channel_id}. Sleeping for {e.value + 5} seconds.")
+            await asyncio.sleep(e.value + 5)
+            await self._send_post_limited(channel_id, poster, caption, footer_keyboard)
+
+    async def _send_post_limited(self, channel_id, poster, caption, footer_keyboard):
+        """Sends a post while holding a post slot and a send-rate token."""
+        async with self.post_semaphore, self.send_limiter:
+            return await self._send_post(channel_id, poster, caption, footer_keyboard)
+
+    async def _send_post(self, channel_id, poster, caption, footer_keyboard):
+        """Sends a post as a photo when it has a poster, otherwise as plain text."""
+        if poster:
+            return await self.send_photo(channel_id, photo=as_input_photo(poster), caption=caption, reply_markup=footer_keyboard)
+        return await self.send_message(channel_id, caption, reply_markup=footer_keyboard, disable_web_page_preview=True)
 
     async def start_web_server(self):
         self.web_app = web.Application()
+        # Built once here so each redirect is a single %-substitution.
+        self.web_app[REDIRECT_TEMPLATE] = f"https://t.me/{self.me.username}?start=get_%s"
         self.web_app.router.add_get('/get/{file_unique_id}', handle_redirect)
-        self.web_runner = web.AppRunner(self.web_app)
+        self.web_runner = web.AppRunner(self.web_app, access_log=None)
         await self.web_runner.setup()
         site = web.TCPSite(self.web_runner, Config.VPS_IP, Config.VPS_PORT)
         await site.start()
@@ -144,20 +170,22 @@ class Bot(Client):
         self.me = await self.get_me()
         
         os.makedirs("resources", exist_ok=True)
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get("https://github.com/google/fonts/raw/main/ofl/opensans/OpenSans-Bold.ttf") as resp:
-                    if resp.status == 200:
-                        with open("./resources/font.ttf", "wb") as f: f.write(await resp.read())
-        except Exception as e:
-            logger.warning(f"Could not download fallback font, will use default. Error: {e}")
+        await load_poster_cache()
+        if not (os.path.exists(FONT_PATH) and os.path.getsize(FONT_PATH) > 0):
+            try:
+                async with aiohttp.ClientSession() as session:
+                    async with session.get("https://github.com/google/fonts/raw/main/ofl/opensans/OpenSans-Bold.ttf") as resp:
+                        if resp.status == 200:
+                            await asyncio.get_running_loop().run_in_executor(None, _write_file, FONT_PATH, await resp.read(), 'wb')
+            except Exception as e:
+                logger.warning(f"Could not download fallback font, will use default. Error: {e}")
 
         self.owner_db_channel_id = await get_owner_db_channel()
         if self.owner_db_channel_id: logger.info(f"Loaded Owner DB ID [{self.owner_db_channel_id}]")
         else: logger.warning("Owner DB ID not set. Please use admin panel.")
         
         try:
-            with open(Config.BOT_USERNAME_FILE, 'w') as f: f.write(f"@{self.me.username}")
+            await asyncio.get_running_loop().run_in_executor(None, _write_file, Config.BOT_USERNAME_FILE, f"@{self.me.username}")
         except Exception as e:
             logger.error(f"Could not write to {Config.BOT_USERNAME_FILE}: {e}")
         
@@ -168,6 +196,8 @@ class Bot(Client):
     async def stop(self, *args):
         logger.info("Stopping bot...")
         if self.web_runner: await self.web_runner.cleanup()
+        await close_session()
+        await save_poster_cache()
         await super().stop()
         logger.info("Bot stopped.")
 
@@ -1,4 +1,5 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from cachetools import TTLCache
 from config import Config
 
 client = AsyncIOMotorClient(Config.MONGO_URI)
@@ -8,6 +9,28 @@ users = db['users']
 files = db['files']
 bot_settings = db['bot_settings']
 
+# Short-lived cache of user documents; every write below invalidates its user.
+_user_cache = TTLCache(maxsize=2048, ttl=30)
+
+# DB channel id -> owner user id. Checked for every incoming file; cleared whenever any user's
+# db_channels list changes. Channels nobody indexes are remembered only briefly, so a channel that
+# is being set up starts indexing soon even if a lookup raced the change.
+_db_channel_owners = TTLCache(maxsize=4096, ttl=600)
+_unowned_db_channels = TTLCache(maxsize=4096, ttl=30)
+# Bumped on every clear; a lookup that straddles a clear does not store its possibly stale result.
+_db_channel_generation = 0
+
+def invalidate_user(user_id):
+    _user_cache.pop(user_id, None)
+
+def _invalidate_list(user_id, list_name):
+    global _db_channel_generation
+    invalidate_user(user_id)
+    if list_name == 'db_channels':
+        _db_channel_generation += 1
+        _db_channel_owners.clear()
+        _unowned_db_channels.clear()
+
 async def add_user(user_id):
     """Adds a new user to the database if they don't already exist."""
     user_data = {
@@ -24,6 +47,7 @@ async def add_user(user_id):
         'how_to_download_link': None
     }
     await users.update_one({'user_id': user_id}, {"$setOnInsert": user_data}, upsert=True)
+    invalidate_user(user_id)
 
 # (The rest of the file is unchanged, providing for completeness)
 async def set_owner_db_channel(channel_id: int):
@@ -51,7 +75,11 @@ async def save_file_data(owner_id, original_message, copied_message):
     )
 
 async def get_user(user_id):
-    return await users.find_one({'user_id': user_id})
+    if user_id in _user_cache:
+        return _user_cache[user_id]
+    user = await users.find_one({'user_id': user_id})
+    _user_cache[user_id] = user
+    return user
 
 async def get_all_user_ids(storage_owners_only=False):
     query = {}
@@ -78,16 +106,30 @@ async def get_storage_owners_count():
 
 async def update_user(user_id, key, value):
     await users.update_one({'user_id': user_id}, {'$set': {key: value}}, upsert=True)
+    _invalidate_list(user_id, key)
 
 async def add_to_list(user_id, list_name, item):
     await users.update_one({'user_id': user_id}, {'$addToSet': {list_name: item}})
+    _invalidate_list(user_id, list_name)
 
 async def remove_from_list(user_id, list_name, item):
     await users.update_one({'user_id': user_id}, {'$pull': {list_name: item}})
+    _invalidate_list(user_id, list_name)
 
 async def find_owner_by_db_channel(channel_id):
+    if channel_id in _db_channel_owners:
+        return _db_channel_owners[channel_id]
+    if channel_id in _unowned_db_channels:
+        return None
+    generation = _db_channel_generation
     user = await users.find_one({'db_channels': channel_id})
-    return user['user_id'] if user else None
+    owner = user['user_id'] if user else None
+    if generation == _db_channel_generation:
+        if owner is None:
+            _unowned_db_channels[channel_id] = True
+        else:
+            _db_channel_owners[channel_id] = owner
+    return owner
 
 async def get_file_by_unique_id(file_unique_id: str):
     return await files.find_one({'file_unique_id': file_unique_id})
@@ -117,9 +159,11 @@ async def total_users_count():
 async def add_footer_button(user_id, button_name, button_url):
     button = {'name': button_name, 'url': button_url}
     await users.update_one({'user_id': user_id}, {'$push': {'footer_buttons': button}})
+    invalidate_user(user_id)
 
 async def remove_footer_button(user_id, button_name):
     await users.update_one({'user_id': user_id}, {'$pull': {'footer_buttons': {'name': button_name}}})
+    invalidate_user(user_id)
 
 async def delete_all_files():
     result = await files.delete_many({})
@@ -1,51 +1,226 @@
-import aiohttp
+import httpx
 from imdb import Cinemagoer
 import logging
 from urllib.parse import quote_plus
-from telegraph.aio import Telegraph as AsyncTelegraph
 from io import BytesIO
 from PIL import Image, ImageDraw, ImageFont
 import os
+import re
+import json
+import html
+import time
 import asyncio
-from bs4 import BeautifulSoup
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Optional
 
 logger = logging.getLogger(__name__)
 
-# --- Initialize Cinemagoer and Telegraph ---
-ia = Cinemagoer()
-aio_telegraph = AsyncTelegraph()
+# --- Cinemagoer ---
+# Cinemagoer is blocking; give it its own threads so it never queues behind other executor work.
+_IMDB_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="imdb")
+# Built on first lookup inside the pool, not at import: its constructor sets up a local data store on disk.
+_ia = None
+_ia_lock = threading.Lock()
+
+def _get_imdb():
+    """Returns the shared Cinemagoer client, creating it on first use. Runs on an IMDb pool thread."""
+    global _ia
+    if _ia is None:
+        with _ia_lock:
+            if _ia is None:
+                _ia = Cinemagoer()
+    return _ia
+
+# --- Shared HTTP/2 session (one multiplexed TLS connection per host between lookups) ---
+_DEFAULT_HEADERS = {'User-Agent': 'Mozilla/5.0', 'Accept-Language': 'en-US,en;q=0.5'}
+_session: Optional[httpx.AsyncClient] = None
+
+async def _get_session():
+    """Returns the shared poster session, creating it on first use inside the running loop."""
+    global _session
+    if _session is None or _session.is_closed:
+        _session = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=75),
+            headers=_DEFAULT_HEADERS,
+            # A stalled connect fails fast instead of eating the whole lookup budget.
+            timeout=httpx.Timeout(8, connect=3),
+            follow_redirects=True
+        )
+    return _session
+
+async def close_session():
+    """Closes the shared poster session. Called when the bot stops."""
+    global _session
+    if _session is not None and not _session.is_closed:
+        await _session.aclose()
+    _session = None
+
+# Transient failures (rate limits, gateway errors, dropped connections) are retried
+# with exponential backoff before a source is given up on.
+_RETRY_ATTEMPTS = 3
+_RETRY_BASE_DELAY = 0.3
+_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+@asynccontextmanager
+async def _open(session, url, headers=None):
+    """Opens a streamed GET, retrying transient errors. The last response or error is what callers see."""
+    for attempt in range(_RETRY_ATTEMPTS):
+        last_attempt = attempt == _RETRY_ATTEMPTS - 1
+        try:
+            response = await session.send(session.build_request("GET", url, headers=headers), stream=True)
+        except httpx.TransportError:
+            if last_attempt: raise
+        else:
+            if response.status_code not in _RETRY_STATUSES or last_attempt:
+                break
+            await response.aclose()
+        await asyncio.sleep(_RETRY_BASE_DELAY * 2 ** attempt)
+    try:
+        yield response
+    finally:
+        await response.aclose()
+
+# --- Poster cache (title+year -> poster link or fallback bytes), LRU with per-entry expiry ---
+POSTER_CACHE_FILE = "./resources/poster_cache.json"
+_POSTER_CACHE_SIZE = 2048
+_POSTER_TTL = 86400  # A real poster rarely changes; keep it for a day.
+_MISS_TTL = 3600     # Retry titles that only got a generated fallback after an hour.
+_poster_cache = OrderedDict()
+
+def _cache_key(clean_title, year):
+    return f"{clean_title.lower().strip()}|{year or ''}"
+
+def _cache_get(key):
+    entry = _poster_cache.get(key)
+    if not entry:
+        return None
+    expires_at, poster = entry
+    if expires_at < time.time():
+        del _poster_cache[key]
+        return None
+    _poster_cache.move_to_end(key)
+    return poster
+
+def _cache_set(key, poster, ttl):
+    _poster_cache[key] = (time.time() + ttl, poster)
+    _poster_cache.move_to_end(key)
+    while len(_poster_cache) > _POSTER_CACHE_SIZE:
+        _poster_cache.popitem(last=False)
+
+def _read_json(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def _write_json(path, data):
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+async def load_poster_cache(path=POSTER_CACHE_FILE):
+    """Restores cached poster links saved by a previous run, dropping expired ones."""
+    try:
+        entries = await asyncio.get_running_loop().run_in_executor(None, _read_json, path)
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        logger.warning("Could not load poster cache from %s: %s", path, e)
+        return
+    now = time.time()
+    for key, expires_at, poster in entries:
+        if expires_at > now:
+            _poster_cache[key] = (expires_at, poster)
+    logger.info("Loaded %d cached posters.", len(_poster_cache))
+
+async def save_poster_cache(path=POSTER_CACHE_FILE):
+    """Writes the poster cache to disk so restarts keep their hits."""
+    # Snapshot on the event loop; only the file write runs in a thread.
+    # Rendered fallback bytes stay in memory only; they are cheap to redraw.
+    entries = [[key, expires_at, poster] for key, (expires_at, poster) in _poster_cache.items() if isinstance(poster, str)]
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, _write_json, path, entries)
+    except Exception as e:
+        logger.warning("Could not save poster cache to %s: %s", path, e)
+
+# --- Partial page reads: stop downloading once the markup we need has arrived ---
+_SCAN_CHUNK = 16384
+_SCAN_LIMIT = 262144
+# Asks servers that honor ranges not to send past the scan limit; others just answer 200 in full.
+_SCAN_RANGE = {'Range': f'bytes=0-{_SCAN_LIMIT - 1}'}
+_PAGE_OK = (200, 206)
+
+async def _read_until(response, marker, limit=_SCAN_LIMIT):
+    """Reads the body until `marker` plus one more chunk of markup is buffered, capped at `limit` bytes.
+    Returns raw bytes so the patterns below can scan them without decoding."""
+    buf = bytearray()
+    found_at = -1
+    async for chunk in response.aiter_bytes(_SCAN_CHUNK):
+        buf += chunk
+        if found_at < 0:
+            found_at = buf.find(marker, max(0, len(buf) - len(chunk) - len(marker)))
+        if (found_at >= 0 and len(buf) - found_at >= _SCAN_CHUNK) or len(buf) >= limit:
+            break
+    return bytes(buf)
+
+TELEGRAPH_UPLOAD_URL = "https://telegra.ph/upload"
+
+async def _telegraph_upload(session, content, content_type):
+    """Posts image bytes to telegra.ph on the shared session and returns the hosted link.
+    Raises ValueError if telegra.ph answers with an error status or rejects the upload; callers catch it."""
+    response = await session.post(TELEGRAPH_UPLOAD_URL, files={'file': ('file', content, content_type)})
+    if response.status_code != 200:
+        raise ValueError(f"telegra.ph upload failed with HTTP {response.status_code}")
+    path = response.json()
+    if isinstance(path, list) and path and isinstance(path[0], dict) and 'src' in path[0]:
+        return 'https://telegra.ph' + path[0]['src']
+    error = path.get('error') if isinstance(path, dict) else path
+    raise ValueError(f"telegra.ph rejected the upload: {error}")
 
 async def _upload_to_telegraph(session, image_url):
     """Downloads an image and re-uploads it to telegra.ph for a 100% reliable link."""
     try:
-        async with session.get(image_url) as response:
-            if response.status == 200:
-                content = await response.read()
-                path = await aio_telegraph.upload_file(BytesIO(content))
-                if isinstance(path, list) and path and isinstance(path[0], dict) and 'src' in path[0]:
-                    return 'https://telegra.ph' + path[0]['src']
+        async with _open(session, image_url) as response:
+            if response.status_code != 200: return None
+            content = await response.aread()
+            content_type = response.headers.get('content-type', 'image/jpeg')
+        return await _telegraph_upload(session, content, content_type)
     except Exception as e:
-        logger.error(f"Failed to upload image to Telegraph: {e}")
+        logger.error("Failed to upload image to Telegraph: %s", e)
     return None
 
-async def _generate_fallback_image(text):
-    """Generates a fallback image in memory and uploads it to telegra.ph."""
-    font_path = "./resources/font.ttf"
-    try:
-        font = ImageFont.truetype(font_path, 40) if os.path.exists(font_path) else ImageFont.load_default()
-    except IOError:
-        font = ImageFont.load_default()
-    
-    image = Image.new('RGB', (600, 800), color=(15, 15, 15))
+FONT_PATH = "./resources/font.ttf"
+_font = None
+# Blank card every fallback is drawn on; copied, never drawn on directly.
+_TEMPLATE = Image.new('RGB', (600, 800), color=(15, 15, 15))
+
+def _get_font():
+    """Returns the fallback font, parsed once. The font is downloaded at startup, after this
+    module is imported, so the default font is used but not cached until the file exists."""
+    global _font
+    if _font is None:
+        try:
+            if os.path.exists(FONT_PATH):
+                _font = ImageFont.truetype(FONT_PATH, 40)
+        except IOError:
+            pass
+    return _font or ImageFont.load_default()
+
+@lru_cache(maxsize=256)
+def _render_fallback_image(text):
+    """Draws the title on a dark 600x800 card and returns it as JPEG bytes."""
+    font = _get_font()
+    image = _TEMPLATE.copy()
     draw = ImageDraw.Draw(image)
     
     words = text.split()
     lines = []
     current_line = ""
     for word in words:
-        # Use textbbox for modern Pillow versions
-        bbox = draw.textbbox((0, 0), current_line + word, font=font)
-        if bbox[2] < 550:
+        # Advance width only; no glyph bounding box is needed to decide the wrap.
+        if font.getlength(current_line + word) < 550:
             current_line += word + " "
         else:
             lines.append(current_line)
@@ -60,81 +235,181 @@ async def _generate_fallback_image(text):
         y_text += height + 10
 
     buffer = BytesIO()
-    image.save(buffer, format="PNG")
-    buffer.seek(0)
-    
+    # JPEG encodes far faster than PNG's zlib pass; size is similar for a flat card.
+    image.save(buffer, format="JPEG", quality=85, subsampling=2)
+    return buffer.getvalue()
+
+async def _generate_fallback_image(session, text):
+    """Generates a fallback image in memory and uploads it to telegra.ph.
+    If the upload fails, the raw image bytes are returned so they can be sent directly."""
+    image_bytes = _render_fallback_image(text)
     try:
-        path = await aio_telegraph.upload_file(buffer)
-        if isinstance(path, list) and path and isinstance(path[0], dict) and 'src' in path[0]:
-            return 'https://telegra.ph' + path[0]['src']
+        return await _telegraph_upload(session, image_bytes, 'image/jpeg')
     except Exception as e:
-        logger.error(f"Failed to upload fallback image to Telegraph: {e}")
+        logger.error("Failed to upload fallback image to Telegraph: %s", e)
     
-    return f"https://via.placeholder.com/600x800/0F0F0F/FFFFFF?text={quote_plus(text)}"
+    return image_bytes
+
+def as_input_photo(poster):
+    """Wraps generated image bytes in a fresh named buffer for send_photo; links are returned as-is."""
+    if isinstance(poster, bytes):
+        photo = BytesIO(poster)
+        photo.name = "poster.jpg"
+        return photo
+    return poster
+
+# --- TMDB markup patterns, matched directly on the raw page bytes ---
+# First "a.image" inside a "div.card.style_1" search result.
+_TMDB_RESULT_RE = re.compile(rb'class="[^"]*\bcard\b[^"]*\bstyle_1\b.*?<a\b([^>]*\bclass="[^"]*\bimage\b[^"]*"[^>]*)>', re.DOTALL)
+# First "img.poster" inside a "div.poster" on the title page.
+_TMDB_POSTER_RE = re.compile(rb'<div\b[^>]*\bclass="[^"]*\bposter\b[^"]*"[^>]*>.*?<img\b([^>]*\bclass="[^"]*\bposter\b[^"]*"[^>]*)>', re.DOTALL)
+_IMG_TAG_RE = re.compile(rb'<img\b([^>]*)>')
+# Image path after the size segment of a TMDB image URL, e.g. /t/p/w94_and_h141_bestv2/abc.jpg
+_TMDB_IMAGE_PATH_RE = re.compile(r'/t/p/[^/]+(/[^/?#]+)$')
+_HREF_RE = re.compile(rb'\bhref="([^"]+)"')
+_SRC_RE = re.compile(rb'\bsrc="([^"]+)"')
+
+def _tag_attribute(tag_pattern, attr_pattern, body):
+    """Returns one attribute of the first tag matched by `tag_pattern`, or None."""
+    tag = tag_pattern.search(body)
+    attr = attr_pattern.search(tag.group(1)) if tag else None
+    return html.unescape(attr.group(1).decode()) if attr else None
+
+def _tmdb_result(body):
+    """Returns (href, thumbnail src) of the first search result card; either may be None."""
+    tag = _TMDB_RESULT_RE.search(body)
+    if not tag:
+        return None, None
+    href = _HREF_RE.search(tag.group(1))
+    # Only look for the thumbnail inside this card, never in the next one.
+    card_end = body.find(b'style_1', tag.end())
+    img = _IMG_TAG_RE.search(body, tag.end(), card_end if card_end >= 0 else len(body))
+    src = _SRC_RE.search(img.group(1)) if img else None
+    return (html.unescape(href.group(1).decode()) if href else None,
+            html.unescape(src.group(1).decode()) if src else None)
 
 async def _fetch_from_tmdb(session, title, year):
     """Secondary Method: Scrapes poster from The Movie Database (TMDB)."""
     try:
         search_query = f"{title} {year}" if year else title
         search_url = f"https://www.themoviedb.org/search?query={quote_plus(search_query)}"
-        headers = {'User-Agent': 'Mozilla/5.0', 'Accept-Language': 'en-US,en;q=0.5'}
         
-        async with session.get(search_url, headers=headers) as response:
-            if response.status != 200: return None
-            soup = BeautifulSoup(await response.text(), 'html.parser')
-            
-            result_card = soup.select_one("div.card.style_1 a.image")
-            if not result_card or not result_card.get('href'): return None
-            
-            media_url = "https://www.themoviedb.org" + result_card['href']
-            
-        async with session.get(media_url, headers=headers) as media_response:
-            if media_response.status != 200: return None
-            media_soup = BeautifulSoup(await media_response.text(), 'html.parser')
-            
-            poster_div = media_soup.select_one("div.poster img.poster")
-            if poster_div and poster_div.get('src'):
-                poster_path = poster_div['src']
-                full_poster_url = f"https://image.tmdb.org/t/p/original{poster_path}"
-                logger.info(f"Found poster on TMDB for '{title}'.")
-                return await _upload_to_telegraph(session, full_poster_url)
+        async with _open(session, search_url, _SCAN_RANGE) as response:
+            if response.status_code not in _PAGE_OK: return None
+            href, thumb = _tmdb_result(await _read_until(response, b'style_1'))
+            if not href: return None
+            # The result thumbnail shares the poster's image path, so the title page is usually not needed.
+            match = _TMDB_IMAGE_PATH_RE.search(thumb) if thumb else None
+            poster_path = match.group(1) if match else None
+
+        if not poster_path:
+            async with _open(session, "https://www.themoviedb.org" + href, _SCAN_RANGE) as media_response:
+                if media_response.status_code not in _PAGE_OK: return None
+                poster_path = _tag_attribute(_TMDB_POSTER_RE, _SRC_RE, await _read_until(media_response, b'class="poster'))
+        if poster_path:
+            full_poster_url = f"https://image.tmdb.org/t/p/original{poster_path}"
+            logger.info("Found poster on TMDB for '%s'.", title)
+            return await _upload_to_telegraph(session, full_poster_url)
     except Exception as e:
-        logger.error(f"An error occurred during TMDB scrape: {e}")
+        logger.error("An error occurred during TMDB scrape: %s", e)
     return None
 
+# Lookups currently running, keyed like the cache, so concurrent callers share one search.
+_inflight = {}
+
+class _SearchAbandoned(Exception):
+    """Set on a shared lookup whose leading caller was cancelled; waiters then run the search themselves."""
+
 async def get_poster(clean_title: str, year: str = None):
-    """The 'Hero' Poster Finder with a multi-layered approach."""
-    logger.info(f"Poster search initiated for: Title='{clean_title}', Year='{year}'")
-    search_query = f"{clean_title} {year}" if year else clean_title
+    """The 'Hero' Poster Finder with a multi-layered approach. Results are cached per title and year."""
+    cache_key = _cache_key(clean_title, year)
+    while True:
+        cached = _cache_get(cache_key)
+        if cached:
+            return cached
+        shared = _inflight.get(cache_key)
+        if shared is None:
+            break
+        try:
+            return await asyncio.shield(shared)
+        except _SearchAbandoned:
+            continue
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[cache_key] = future
+    try:
+        poster, found = await _search_poster(clean_title, year)
+        _cache_set(cache_key, poster, _POSTER_TTL if found else _MISS_TTL)
+        future.set_result(poster)
+        return poster
+    except asyncio.CancelledError:
+        # Only the leader is being cancelled; waiters must not inherit it.
+        future.set_exception(_SearchAbandoned())
+        future.exception()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        # Mark the exception retrieved; waiters re-raise it themselves.
+        future.exception()
+        raise
+    finally:
+        _inflight.pop(cache_key, None)
 
-    # --- Attempt 1: Primary Source (Cinemagoer/IMDb) ---
+# Seconds Cinemagoer runs alone before TMDB is started alongside it.
+_PRIMARY_HEAD_START = 0.3
+# Seconds both sources get in total before the fallback card is used instead.
+_SOURCES_DEADLINE = 10
+
+async def _fetch_from_cinemagoer(session, search_query):
+    """Primary Method: Looks the title up on IMDb via Cinemagoer and mirrors the cover to telegra.ph."""
     try:
-        loop = asyncio.get_event_loop()
-        movies = await loop.run_in_executor(None, lambda: ia.search_movie(search_query))
+        loop = asyncio.get_running_loop()
+        ia = await loop.run_in_executor(_IMDB_POOL, _get_imdb)
+        movies = await loop.run_in_executor(_IMDB_POOL, ia.search_movie, search_query)
         
         if movies:
-            movie_id = movies[0].movieID
-            movie = await loop.run_in_executor(None, lambda: ia.get_movie(movie_id))
+            movie = await loop.run_in_executor(_IMDB_POOL, ia.get_movie, movies[0].movieID)
             
             if movie and 'full-size cover url' in movie:
-                poster_url = movie['full-size cover url']
-                async with aiohttp.ClientSession() as session:
-                    telegraph_link = await _upload_to_telegraph(session, poster_url)
-                    if telegraph_link:
-                        logger.info(f"Successfully processed poster for '{clean_title}' via Cinemagoer/Telegraph.")
-                        return telegraph_link
+                return await _upload_to_telegraph(session, movie['full-size cover url'])
     except Exception as e:
-        logger.error(f"An error occurred during Cinemagoer search: {e}")
+        logger.error("An error occurred during Cinemagoer search: %s", e)
+    return None
+
+async def _search_poster(clean_title, year):
+    """Runs the source chain. Returns (poster, found) where found is False for generated fallbacks."""
+    logger.info("Poster search initiated for: Title='%s', Year='%s'", clean_title, year)
+    search_query = f"{clean_title} {year}" if year else clean_title
+
+    session = await _get_session()
 
-    # --- Attempt 2: Secondary Source (TMDB Scraping) ---
-    logger.warning("Cinemagoer failed. Trying secondary source: TMDB.")
-    async with aiohttp.ClientSession() as session:
-        tmdb_link = await _fetch_from_tmdb(session, clean_title, year)
-        if tmdb_link:
-            logger.info(f"Successfully processed poster for '{clean_title}' via TMDB/Telegraph.")
-            return tmdb_link
+    # --- Attempts 1 & 2: Cinemagoer/IMDb and TMDB, raced against each other ---
+    # Cinemagoer gets a short head start so its answer wins whenever it is quick.
+    # Neither may hold the batch up past the deadline; a stuck Cinemagoer thread is simply abandoned.
+    deadline = asyncio.get_running_loop().time() + _SOURCES_DEADLINE
+    cinemagoer_task = asyncio.create_task(_fetch_from_cinemagoer(session, search_query))
+    sources = {cinemagoer_task: "Cinemagoer"}
+    await asyncio.wait(sources, timeout=_PRIMARY_HEAD_START)
+    if not (cinemagoer_task.done() and cinemagoer_task.result()):
+        sources[asyncio.create_task(_fetch_from_tmdb(session, clean_title, year))] = "TMDB"
+    pending = set(sources)
+    try:
+        while pending:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                logger.warning("Poster sources for '%s' timed out after %ss.", clean_title, _SOURCES_DEADLINE)
+                break
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                link = task.result()
+                if link:
+                    logger.info("Successfully processed poster for '%s' via %s/Telegraph.", clean_title, sources[task])
+                    return link, True
+    finally:
+        for task in pending:
+            task.cancel()
 
     # --- Attempt 3: Ultimate Fallback (Generate Image) ---
-    logger.warning(f"All other methods failed. Generating fallback image for '{clean_title}'.")
+    logger.warning("All other methods failed. Generating fallback image for '%s'.", clean_title)
     fallback_text = f"{clean_title}\n({year})" if year else clean_title
-    return await _generate_fallback_image(fallback_text)
+    return await _generate_fallback_image(session, fallback_text), False
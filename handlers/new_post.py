@@ -1,37 +1,69 @@
 import asyncio
-import re
 import logging
 from pyrogram import Client, filters
 from config import Config
 from database.db import find_owner_by_db_channel
-from utils.helpers import extract_file_details
+from utils.helpers import get_batch_key, get_media
 
 logger = logging.getLogger(__name__)
 
-def get_batch_key(filename: str):
-    """Creates a batching key based on the 'clean_title' and year for perfect grouping."""
-    details = extract_file_details(filename)
-    title = details.get('clean_title', 'untitled').strip()
-    year = details.get('year', '0000')
-    return f"{title}_{year}".lower()
+# A batch is queued once no new file has joined it for BATCH_IDLE_SECONDS,
+# or after BATCH_MAX_WAIT_SECONDS if files keep trickling in.
+BATCH_IDLE_SECONDS = 5
+BATCH_MAX_WAIT_SECONDS = 120
+
+# Files waiting to be queued, keyed by (user_id, batch_key), with when each batch opened and its idle timer.
+_pending = {}
+_started = {}
+_timers = {}
+
+# Intake tasks are referenced here until they finish so none is garbage-collected mid-flight;
+# the semaphore caps how many owner lookups run at once during a burst.
+_intake_tasks = set()
+_intake_limit = asyncio.Semaphore(50)
+
+def _flush(client, key):
+    """Moves one pending batch onto the processing queue as a single item."""
+    timer = _timers.pop(key, None)
+    if timer: timer.cancel()
+    _started.pop(key, None)
+    messages = _pending.pop(key, None)
+    if messages:
+        client.file_queue.put_nowait((messages, key[0]))
+        logger.info("Queued a batch of %d file(s) for user %s.", len(messages), key[0])
 
 @Client.on_message(filters.channel & (filters.document | filters.video | filters.audio), group=2)
 async def new_file_handler(client, message):
-    """Adds incoming files to the processing queue."""
+    """Hands each incoming file to a background task so the dispatcher can move straight on to the next update."""
+    task = asyncio.create_task(_batch_file(client, message))
+    _intake_tasks.add(task)
+    task.add_done_callback(_intake_tasks.discard)
+
+async def _batch_file(client, message):
+    """Groups incoming files by title and year, then queues each group once it goes quiet."""
     try:
-        user_id = await find_owner_by_db_channel(message.chat.id)
+        async with _intake_limit:
+            user_id = await find_owner_by_db_channel(message.chat.id)
         if not user_id: 
             if hasattr(client, 'owner_db_channel_id') and message.chat.id == client.owner_db_channel_id and Config.ADMIN_ID:
                  user_id = Config.ADMIN_ID
             else:
                 return
 
-        media = getattr(message, message.media.value, None)
+        media = get_media(message)
         if not media or not getattr(media, 'file_name', None):
             return
         
-        await client.file_queue.put((message, user_id))
-        logger.info(f"Added file '{media.file_name}' to the processing queue for user {user_id}.")
+        key = (user_id, get_batch_key(media.file_name))
+        loop = asyncio.get_running_loop()
+        _pending.setdefault(key, []).append(message)
+        started = _started.setdefault(key, loop.time())
+        timer = _timers.pop(key, None)
+        if timer: timer.cancel()
+        if loop.time() - started >= BATCH_MAX_WAIT_SECONDS:
+            _flush(client, key)
+        else:
+            _timers[key] = loop.call_later(BATCH_IDLE_SECONDS, _flush, client, key)
 
     except Exception as e:
-        logger.exception(f"Error in new_file_handler while adding to queue: {e}")
+        logger.exception("Error in new_file_handler while batching file: %s", e)
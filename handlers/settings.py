@@ -9,8 +9,8 @@ from database.db import (
     get_user_file_count, add_footer_button, remove_footer_button, 
     get_all_user_files, get_paginated_files, search_user_files
 )
-from utils.helpers import go_back_button, get_main_menu, create_post, encode_link, decode_link
-from handlers.new_post import get_batch_key
+from utils.helpers import go_back_button, get_main_menu, create_post, encode_link, decode_link, get_batch_key
+from features.poster import as_input_photo
 
 logger = logging.getLogger(__name__)
 ACTIVE_BACKUP_TASKS = set()
@@ -120,7 +120,8 @@ async def my_files_handler(client, query):
         page = int(query.data.split("_")[-1])
         total_files = await get_user_file_count(user_id)
         files_per_page = 5
-        bot_username = client.me.username
+        # 'directget_' links skip the shortener for the owner's own files.
+        link_prefix = f"https://t.me/{client.me.username}?start=directget_"
         
         text = f"**📂 Your Saved Files ({total_files} Total)**\n\n"
         
@@ -131,11 +132,10 @@ async def my_files_handler(client, query):
             if not files_on_page:
                 text += "No more files found on this page."
             else:
-                for file in files_on_page:
-                    # **THE FIX**: Use 'directget_' prefix for shortener-free access
-                    payload = f"directget_{file['file_unique_id']}"
-                    deep_link = f"https://t.me/{bot_username}?start={payload}"
-                    text += f"**File:** `{file['file_name']}`\n**Link:** [Click Here to Get File]({deep_link})\n\n"
+                text += "".join(
+                    f"**File:** `{file['file_name']}`\n**Link:** [Click Here to Get File]({link_prefix}{file['file_unique_id']})\n\n"
+                    for file in files_on_page
+                )
                     
         buttons, nav_row = [], []
         if page > 1:
@@ -154,16 +154,15 @@ async def my_files_handler(client, query):
 async def _format_and_send_search_results(client, query, user_id, search_query, page):
     files_per_page = 5
     files_list, total_files = await search_user_files(user_id, search_query, page, files_per_page)
-    bot_username = client.me.username
+    link_prefix = f"https://t.me/{client.me.username}?start=directget_"
     text = f"**🔎 Search Results for `{search_query}` ({total_files} Found)**\n\n"
     if not files_list:
         text += "No files found for your query."
     else:
-        for file in files_list:
-            # **THE FIX**: Use 'directget_' prefix for shortener-free access
-            payload = f"directget_{file['file_unique_id']}"
-            deep_link = f"https://t.me/{bot_username}?start={payload}"
-            text += f"**File:** `{file['file_name']}`\n**Link:** [Click Here to Get File]({deep_link})\n\n"
+        text += "".join(
+            f"**File:** `{file['file_name']}`\n**Link:** [Click Here to Get File]({link_prefix}{file['file_unique_id']})\n\n"
+            for file in files_list
+        )
     buttons = []
     nav_row = []
     encoded_query = encode_link(search_query)
@@ -262,7 +261,7 @@ async def start_backup_process(client, query):
                 
                 poster, caption, footer = await create_post(client, user_id, file_messages)
                 if poster:
-                    await client.send_photo(channel_id, photo=poster, caption=caption, reply_markup=footer)
+                    await client.send_photo(channel_id, photo=as_input_photo(poster), caption=caption, reply_markup=footer)
                 else:
                     await client.send_message(channel_id, caption, reply_markup=footer, disable_web_page_preview=True)
                 
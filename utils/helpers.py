@@ -1,6 +1,11 @@
 import re
 import base64
 import logging
+from functools import lru_cache
+from dataclasses import dataclass
+from typing import Optional
+from operator import attrgetter
+from pyrogram.enums import MessageMediaType
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from config import Config
 from database.db import get_user
@@ -8,129 +13,246 @@ from features.poster import get_poster
 
 logger = logging.getLogger(__name__)
 
-def extract_file_details(filename: str):
-    """The definitive filename processor. It ruthlessly cleans the filename to isolate the true title."""
-    details = {'original_name': filename, 'clean_title': None, 'year': None, 'type': 'movie', 'season': None, 'episode': None, 'resolution': None}
-    
+_MEDIA_GETTERS = {
+    MessageMediaType.DOCUMENT: attrgetter('document'),
+    MessageMediaType.VIDEO: attrgetter('video'),
+    MessageMediaType.AUDIO: attrgetter('audio'),
+}
+
+def get_media(message):
+    """Returns the document/video/audio object of a message, or None for any other media."""
+    getter = _MEDIA_GETTERS.get(message.media)
+    return getter(message) if getter else None
+
+# Filename patterns, compiled once; extract_file_details runs for every incoming file.
+# Release markers that end a title; matched whole-word and case-insensitively.
+_STOP_WORDS = ('COMPLETE', 'Marathi', 'Hindi', 'HDTS')
+# The title ends where the first year, episode tag or release marker begins.
+_STOP = r'\b(?:19\d{2}|20\d{2}|[sS]\d{1,2}[eE]\d{1,3}|[sS]\d{1,2}|E\d{1,3}|' + '|'.join(_STOP_WORDS) + r')\b'
+_STOP_RE = re.compile(_STOP, re.IGNORECASE)
+# Every tag and the title's stop point are picked up in a single scan; the first hit of each
+# kind wins. The stop point is a zero-width lookahead, so tags starting at the same offset
+# still match. SxxEyy comes before the bare season tag so "S01.E02" is read as one episode marker.
+# Every alternative starts with a digit, one of s/e/p or a stop word's initial; the leading class
+# lets the engine skip all other offsets without trying each alternative there.
+_TAG_INITIALS = '0-9sep' + ''.join(sorted({word[0].lower() for word in _STOP_WORDS}))
+_TAGS_RE = re.compile(
+    r'(?=[' + _TAG_INITIALS + r'])(?:'
+    r'(?P<stop>(?=' + _STOP + r'))'
+    r'|(?P<se>s(?P<se_season>\d{1,2})[._ ]?e(?P<se_episode>\d{1,3}))'
+    r'|\b(?:ep|episode|part)[\s._]?(?P<ep>\d{1,3})\b'
+    r'|\b(?:season|s)[\s._]?(?P<season>\d{1,2})\b'
+    r'|\b(?P<res>2160p|1080p|720p|540p|480p)\b'
+    r'|\b(?P<year>19[89]\d|20\d{2})\b'
+    r')',
+    re.IGNORECASE
+)
+# Once these are seen nothing later in the name can change the result: SxxEyy overrides
+# separate episode/season tags, and every other kind keeps its first hit.
+_FINAL_TAGS = frozenset(('stop', 'se', 'res', 'year'))
+# Bracketed release noise ([group], (info), {tags}) stripped from titles in one pass.
+_NOISE_RE = re.compile(r'\[.*?\]|\(.*?\)|\{.*?\}')
+# Dots and underscores stand in for spaces in release names; mapped in one translate pass.
+_TITLE_SEPARATORS = str.maketrans('._', '  ')
+
+@dataclass(frozen=True)
+class FileDetails:
+    """What a filename says about its file. Frozen because parsed results are cached and shared.
+    Slots are declared by hand (dataclass(slots=True) needs Python 3.10), so fields take no defaults."""
+    __slots__ = ('original_name', 'clean_title', 'year', 'type', 'season', 'episode', 'resolution')
+    original_name: str
+    clean_title: str
+    year: Optional[str]
+    type: str
+    season: Optional[int]
+    episode: Optional[int]
+    resolution: Optional[str]
+
+@lru_cache(maxsize=4096)
+def extract_file_details(filename: str) -> FileDetails:
+    """The definitive filename processor. It ruthlessly cleans the filename to isolate the true title.
+    Results are memoized per filename and shared between callers."""
     base_name = filename.rsplit('.', 1)[0]
     
-    year_match = re.search(r'\b(19[89]\d|20\d{2})\b', base_name)
-    if year_match:
-        details['year'] = year_match.group(1)
+    tags = {}
+    for match in _TAGS_RE.finditer(base_name):
+        kind = match.lastgroup
+        if kind == 'se' and 'stop' not in tags:
+            # In "xS01.E02" the marker starts at the E, which the scan has already stepped over.
+            inner_stop = _STOP_RE.search(base_name, match.start() + 1)
+            if inner_stop: tags['stop'] = inner_stop
+        tags.setdefault(kind, match)
+        if tags.keys() >= _FINAL_TAGS:
+            break
 
-    se_match = re.search(r'[sS](\d{1,2})[._ ]?[eE](\d{1,3})', base_name)
+    year = tags['year'].group('year') if 'year' in tags else None
+    file_type, season, episode = 'movie', None, None
+
+    se_match = tags.get('se')
     if se_match:
-        details.update({'type': 'series', 'season': int(se_match.group(1)), 'episode': int(se_match.group(2))})
+        file_type, season, episode = 'series', int(se_match.group('se_season')), int(se_match.group('se_episode'))
     else:
-        ep_match = re.search(r'\b(ep|episode|part)[\s._]?(\d{1,3})\b', base_name, re.IGNORECASE)
-        if ep_match:
-            details.update({'type': 'series', 'episode': int(ep_match.group(2))})
-        season_match = re.search(r'\b(season|s)[\s._]?(\d{1,2})\b', base_name, re.IGNORECASE)
-        if season_match:
-            details.update({'type': 'series', 'season': int(season_match.group(2))})
-
-    res_match = re.search(r'\b(2160p|1080p|720p|540p|480p)\b', base_name, re.IGNORECASE)
-    if res_match:
-        details['resolution'] = res_match.group(1)
-
-    title_strip = base_name
-    stop_regex = r'\b(19\d{2}|20\d{2}|[sS]\d{1,2}[eE]\d{1,3}|[sS]\d{1,2}|E\d{1,3}|COMPLETE|S01|Marathi|Hindi|HDTS)\b'
-    stop_point_match = re.search(stop_regex, title_strip, re.IGNORECASE)
-    if stop_point_match:
-        title_strip = title_strip[:stop_point_match.start()]
-    
-    noise_patterns = [r'\[.*?\]', r'\(.*?\)', r'\{.*?\}']
-    for pattern in noise_patterns:
-        title_strip = re.sub(pattern, '', title_strip)
+        if 'ep' in tags:
+            file_type, episode = 'series', int(tags['ep'].group('ep'))
+        if 'season' in tags:
+            file_type, season = 'series', int(tags['season'].group('season'))
+
+    resolution = tags['res'].group('res') if 'res' in tags else None
+
+    title_strip = base_name[:tags['stop'].start()] if 'stop' in tags else base_name
+    title_strip = _NOISE_RE.sub('', title_strip)
         
-    title_strip = title_strip.replace('.', ' ').replace('_', ' ').strip()
-    clean_title = ' '.join(title_strip.split())
+    # split() already drops leading and trailing whitespace while collapsing the runs in between.
+    clean_title = ' '.join(title_strip.translate(_TITLE_SEPARATORS).split())
     
-    details['clean_title'] = clean_title if clean_title else base_name.replace('.', ' ')
-        
-    return details
+    return FileDetails(
+        original_name=filename,
+        clean_title=clean_title if clean_title else base_name.replace('.', ' '),
+        year=year, type=file_type, season=season, episode=episode, resolution=resolution
+    )
 
-def create_link_label(details: dict) -> str:
+# Sized for channels that rotate through many distinct filenames; each entry is a short string pair.
+@lru_cache(maxsize=8192)
+def get_batch_key(filename: str):
+    """Creates a batching key based on the 'clean_title' and year for perfect grouping.
+    The key is a pure function of the filename, so repeats skip the parse entirely."""
+    details = extract_file_details(filename)
+    return f"{details.clean_title.strip()}_{details.year}".lower()
+
+_NUM_SPLIT_RE = re.compile(r'([0-9]+)')
+
+# Keys are link slots such as "1080p" or "ep_1_2", which repeat across nearly every post.
+@lru_cache(maxsize=4096)
+def natural_sort_key(text: str) -> tuple:
+    """Sort key that compares embedded numbers by value, so ep_1_2 comes before ep_1_10 and 480p before 1080p."""
+    # The capturing split alternates text and digit runs, so every odd slot is a number.
+    parts = _NUM_SPLIT_RE.split(text.lower())
+    parts[1::2] = map(int, parts[1::2])
+    return tuple(parts)
+
+# Within a season/episode, higher resolutions sort first so they keep a shared link slot;
+# anything unrecognised sorts after them. Captions order their links separately.
+_RES_RANK = {'2160p': 0, '1080p': 1, '720p': 2, '540p': 3, '480p': 4}
+
+def _file_sort_key(details: FileDetails) -> tuple:
+    """Orders a batch by season, episode and resolution using plain ints; the filename only settles exact ties."""
+    resolution = details.resolution.lower() if details.resolution else None
+    return (details.season or 0, details.episode or 0, _RES_RANK.get(resolution, len(_RES_RANK)), details.original_name)
+
+def create_link_label(details: FileDetails) -> str:
     """Creates a smart label for the download link."""
-    if details['type'] == 'series' and details.get('episode'):
-        return f"Episode {details['episode']:02d}"
-    if details.get('resolution'):
-        return f"{details['resolution']}"
+    if details.type == 'series' and details.episode:
+        return f"Episode {details.episode:02d}"
+    if details.resolution:
+        return details.resolution
     return "Download"
 
-async def create_post(client, user_id, messages):
-    user = await get_user(user_id)
+# Rule drawn above and below the links block of every post.
+_POST_SEPARATOR = "· · ─────── ·𖥸· ─────── · ·"
+
+@lru_cache(maxsize=1024)
+def _footer_markup(buttons):
+    """Builds the footer keyboard for a tuple of (name, url) pairs. Keyed on the buttons themselves,
+    so an edited footer simply misses and users with identical footers share one markup.
+    Rows are one-button tuples, which are lighter than lists and cannot be edited in the shared markup."""
+    return InlineKeyboardMarkup([(InlineKeyboardButton(name, url=url),) for name, url in buttons])
+
+async def create_post(client, user_id, messages, user=None):
+    # Callers that already hold the user's settings pass them in to skip the lookup.
+    if user is None: user = await get_user(user_id)
     if not user: return None, None, None
     
-    bot_username = client.me.username
-    all_details = [extract_file_details(getattr(m, m.media.value).file_name) for m in messages]
-    all_details.sort(key=lambda d: (d.get('season') or 0, d.get('episode') or 0))
+    link_prefix = f"https://t.me/{client.me.username}?start=get_"
+    # Per-file columns that stay index-aligned; only the order permutation is sorted, so links and files cannot mismatch.
+    # Intake already parsed every name for its batch key, so the whole batch is cache hits.
+    medias = list(map(get_media, messages))
+    details_list = list(map(extract_file_details, [media.file_name for media in medias]))
+    unique_ids = [media.file_unique_id for media in medias]
+    is_series = 'series' in [details.type for details in details_list]
+    # Sorting on ints rather than tokenised filenames keeps the result independent of arrival order.
+    sort_keys = list(map(_file_sort_key, details_list))
+    order = sorted(range(len(details_list)), key=sort_keys.__getitem__)
     
-    base_details = all_details[0]
-    title = base_details['clean_title']
-    year = base_details['year']
-    is_series = any(d['type'] == 'series' for d in all_details)
+    base_details = details_list[order[0]]
+    title = base_details.clean_title
+    year = base_details.year
     
     final_links = {}
-    for idx, details in enumerate(all_details):
-        media = getattr(messages[idx], messages[idx].media.value)
-        key = f"ep_{details.get('season', 0)}_{details.get('episode', 0)}" if is_series else details.get('resolution', 'SD')
-        final_links[key] = {
+    for i in order:
+        details = details_list[i]
+        key = f"ep_{details.season}_{details.episode}" if is_series else details.resolution
+        # Files sharing a slot (same episode, or same resolution for movies) keep the first, highest-ranked one.
+        final_links.setdefault(key, {
             'label': create_link_label(details),
-            'url': f"https://t.me/{bot_username}?start=get_{media.file_unique_id}"
-        }
+            'url': link_prefix + unique_ids[i]
+        })
         
-    header = f"🎬  **{title}**"
-    if year: header += f"  `({year})`"
+    header_parts = ["🎬  **", title, "**"]
+    if year: header_parts += ("  `(", year, ")`")
+    header = "".join(header_parts)
     
-    post_poster = await get_poster(title, year)
+    # get_poster is memoized per title and year; users who turned posters off skip it entirely.
+    post_poster = await get_poster(title, year) if user.get('show_poster', True) else None
 
-    links_text = ""
-    sorted_keys = sorted(final_links.keys(), key=lambda x: (str(x).startswith('ep_'), x))
-    for key in sorted_keys:
-        link_info = final_links[key]
-        links_text += f"✨  **{link_info['label']}** ➠  [Watch / Download]({link_info['url']})\n"
+    sorted_keys = sorted(final_links.keys(), key=lambda x: (str(x).startswith('ep_'), natural_sort_key(str(x))))
+    links_text = "\n".join(
+        f"✨  **{final_links[key]['label']}** ➠  [Watch / Download]({final_links[key]['url']})"
+        for key in sorted_keys
+    )
         
-    separator = "· · ─────── ·𖥸· ─────── · ·"
-    final_caption = f"{header}\n\n{separator}\n\n{links_text.strip()}\n\n{separator}"
+    final_caption = f"{header}\n\n{_POST_SEPARATOR}\n\n{links_text}\n\n{_POST_SEPARATOR}"
     
     footer_buttons_data = user.get('footer_buttons', [])
     footer_keyboard = None
     if footer_buttons_data:
-        buttons = [[InlineKeyboardButton(btn['name'], url=btn['url'])] for btn in footer_buttons_data]
-        footer_keyboard = InlineKeyboardMarkup(buttons)
+        footer_keyboard = _footer_markup(tuple((btn['name'], btn['url']) for btn in footer_buttons_data))
         
     return post_poster, final_caption, footer_keyboard
 
 def go_back_button(user_id):
     return InlineKeyboardMarkup([[InlineKeyboardButton("« Go Back", callback_data=f"go_back_{user_id}")]])
 
+_b64encode = base64.urlsafe_b64encode
+_b64decode = base64.urlsafe_b64decode
+
 def encode_link(text: str) -> str:
-    return base64.urlsafe_b64encode(text.encode()).decode().strip("=")
+    return _b64encode(text.encode()).rstrip(b"=").decode("ascii")
 
 def decode_link(encoded_text: str) -> str:
-    padding = 4 - (len(encoded_text) % 4)
-    encoded_text += "=" * padding
-    return base64.urlsafe_b64decode(encoded_text).decode()
+    # Restores exactly the padding encode_link stripped (none when the length is already a multiple of 4).
+    return _b64decode(encoded_text + "=" * (-len(encoded_text) & 3)).decode()
 
 async def get_file_raw_link(message):
     return f"https://t.me/c/{str(message.chat.id).replace('-100', '')}/{message.id}"
 
+# Main-menu buttons that never change, built once and shared between renders.
+_MANAGE_POST_BTN = InlineKeyboardButton("➕ Manage Auto Post", callback_data="manage_post_ch")
+_MANAGE_DB_BTN = InlineKeyboardButton("🗃️ Manage Index DB", callback_data="manage_db_ch")
+_BACKUP_BTN = InlineKeyboardButton("🔄 Backup Links", callback_data="backup_links")
+_FILENAME_LINK_BTN = InlineKeyboardButton("🔗 Set Filename Link", callback_data="set_filename_link")
+_FOOTER_BTN = InlineKeyboardButton("👣 Footer Buttons", callback_data="manage_footer")
+_POSTER_BTN = InlineKeyboardButton("🖼️ IMDb Poster", callback_data="poster_menu")
+_MY_FILES_BTN = InlineKeyboardButton("📂 My Files", callback_data="my_files_1")
+_DOWNLOAD_BTN = InlineKeyboardButton("❓ How to Download", callback_data="set_download")
+_ADMIN_ROWS = (
+    [InlineKeyboardButton("🔑 Set Owner DB", callback_data="set_owner_db")],
+    [InlineKeyboardButton("⚠️ Reset Files DB", callback_data="reset_db_prompt")],
+)
+
 async def get_main_menu(user_id):
     user_settings = await get_user(user_id)
     if not user_settings: return InlineKeyboardMarkup([])
     shortener_text = "⚙️ Shortener Settings" if user_settings.get('shortener_url') else "🔗 Set Shortener"
     fsub_text = "⚙️ Manage FSub" if user_settings.get('fsub_channel') else "📢 Set FSub"
     buttons = [
-        [InlineKeyboardButton("➕ Manage Auto Post", callback_data="manage_post_ch")],
-        [InlineKeyboardButton("🗃️ Manage Index DB", callback_data="manage_db_ch")],
-        [InlineKeyboardButton(shortener_text, callback_data="shortener_menu"), InlineKeyboardButton("🔄 Backup Links", callback_data="backup_links")],
-        [InlineKeyboardButton("🔗 Set Filename Link", callback_data="set_filename_link"), InlineKeyboardButton("👣 Footer Buttons", callback_data="manage_footer")],
-        [InlineKeyboardButton("🖼️ IMDb Poster", callback_data="poster_menu"), InlineKeyboardButton("📂 My Files", callback_data="my_files_1")],
+        [_MANAGE_POST_BTN],
+        [_MANAGE_DB_BTN],
+        [InlineKeyboardButton(shortener_text, callback_data="shortener_menu"), _BACKUP_BTN],
+        [_FILENAME_LINK_BTN, _FOOTER_BTN],
+        [_POSTER_BTN, _MY_FILES_BTN],
         [InlineKeyboardButton(fsub_text, callback_data="set_fsub")],
-        [InlineKeyboardButton("❓ How to Download", callback_data="set_download")]
+        [_DOWNLOAD_BTN]
     ]
     if user_id == Config.ADMIN_ID:
-        buttons.append([InlineKeyboardButton("🔑 Set Owner DB", callback_data="set_owner_db")])
-        buttons.append([InlineKeyboardButton("⚠️ Reset Files DB", callback_data="reset_db_prompt")])
+        buttons.extend(_ADMIN_ROWS)
     return InlineKeyboardMarkup(buttons)